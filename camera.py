@@ -1,12 +1,128 @@
+import os
+
+# keep tflite/xnnpack from claiming every core, opencv and the capture thread need some too
+# has to be set before mediapipe is imported
+os.environ.setdefault("OMP_NUM_THREADS", str(max(1, (os.cpu_count() or 2) // 2)))
+
 import cv2
 import mediapipe as mp
 from mediapipe.tasks import python
 from mediapipe.tasks.python import vision
 import numpy as np
-import os
 import urllib.request
 import time
 import uuid
+import functools
+import itertools
+from collections import deque
+import threading
+import queue
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# turbojpeg is 2-4x faster than opencv's libjpeg path, but it needs the native library installed
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+except ImportError:
+    TurboJPEG = None
+
+# opencv's resize/cvtColor/encode don't need a full thread pool for our frame sizes
+cv2.setNumThreads(2)
+
+# detector categories we care about
+# phones are blacklisted (always bad), study material is whitelisted (allows looking down)
+PHONE_CATEGORIES = frozenset({"cell phone", "mobile phone"})
+STUDY_CATEGORIES = frozenset({"book", "laptop", "tablet"})
+
+
+def _download(url, path):
+    # stream into a .part file and only move it into place once the size checks out,
+    # a truncated model file would crash mediapipe on every start after that
+    part_path = path + ".part"
+    print(f"downloading {os.path.basename(path)}...")
+    with urllib.request.urlopen(url) as res, open(part_path, 'wb') as f:
+        expected = res.headers.get("Content-Length")
+        written = 0
+        while True:
+            chunk = res.read(256 * 1024)
+            if not chunk:
+                break
+            f.write(chunk)
+            written += len(chunk)
+
+    if expected is not None and written != int(expected):
+        os.remove(part_path)
+        raise IOError(f"incomplete download of {url}: got {written} of {expected} bytes")
+    os.replace(part_path, path)
+
+
+def _put_latest(q, item):
+    # runs on the client's event loop. a slow client only ever wants the newest frame,
+    # so anything it hasn't picked up yet is dropped instead of queued behind
+    while not q.empty():
+        q.get_nowait()
+    q.put_nowait(item)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_models():
+    # loaded once per process and shared by every VideoCamera instance
+    # auto-download mediapipe models to local /models folder
+    model_dir = os.path.join(os.path.dirname(__file__), 'models')
+    os.makedirs(model_dir, exist_ok=True)
+
+    # pose model for head tilt/slouch
+    # the 'lite' model is ~3x faster and we only read the y of the nose and shoulders,
+    # so the extra precision of 'full' never shows up in the result
+    pose_path = os.path.join(model_dir, "pose_landmarker_lite.task")
+    # object model for phones and study material
+    # int8 runs ~2x faster on the xnnpack cpu kernels, we only need coarse boxes anyway
+    # saved under its own name so an old float32 download isn't picked up by mistake
+    det_path = os.path.join(model_dir, "efficientdet_lite2_int8.tflite")
+
+    downloads = [
+        ("https://storage.googleapis.com/mediapipe-models/pose_landmarker/pose_landmarker_lite/float16/1/pose_landmarker_lite.task", pose_path),
+        ("https://storage.googleapis.com/mediapipe-models/object_detector/efficientdet_lite2/int8/1/efficientdet_lite2.tflite", det_path),
+    ]
+    missing = [(url, path) for url, path in downloads if not os.path.exists(path)]
+    if missing:
+        # fetch both at once on a cold start, list() so a failed download raises here
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            list(pool.map(lambda job: _download(*job), missing))
+
+    def pose_options(delegate):
+        return vision.PoseLandmarkerOptions(
+            base_options=python.BaseOptions(model_asset_path=pose_path, delegate=delegate),
+            # image mode is stateless: no tracker update and no monotonic timestamp bookkeeping,
+            # which the nose-vs-shoulder check doesn't benefit from anyway
+            running_mode=vision.RunningMode.IMAGE
+        )
+
+    # the pose model is float16 and the heavier of the two, so try to push it onto the gpu
+    # not every platform/build has a gpu delegate, fall back to the cpu if it won't start
+    try:
+        pose_landmarker = vision.PoseLandmarker.create_from_options(
+            pose_options(python.BaseOptions.Delegate.GPU)
+        )
+    except (RuntimeError, NotImplementedError) as e:
+        print(f"gpu delegate unavailable, running pose on cpu: {e}")
+        pose_landmarker = vision.PoseLandmarker.create_from_options(
+            pose_options(python.BaseOptions.Delegate.CPU)
+        )
+
+    # the detector stays on the cpu, the gpu delegate doesn't handle quantized tensors
+    detector = vision.ObjectDetector.create_from_options(
+        vision.ObjectDetectorOptions(
+            base_options=python.BaseOptions(
+                model_asset_path=det_path,
+                delegate=python.BaseOptions.Delegate.CPU
+            ),
+            score_threshold=0.5, # hopefully more confident
+            category_allowlist=sorted(PHONE_CATEGORIES | STUDY_CATEGORIES)
+        )
+    )
+    return pose_landmarker, detector
+
 
 class VideoCamera:
     def __init__(self):
@@ -15,6 +131,8 @@ class VideoCamera:
         # this helps catch phones held lower in the frame than standard webcams show
         # use AVFoundation backend on macOS to avoid crashes
         self.camera = cv2.VideoCapture(0, cv2.CAP_AVFOUNDATION)
+        # ask for mjpg before the resolution, raw yuy2 at 1080p tops out around 5fps over usb 2
+        self.camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
         self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1920) 
         self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)
         # reduce buffer size to avoid crashes on macOS
@@ -22,14 +140,88 @@ class VideoCamera:
         
         if not self.camera.isOpened():
             print("Camera failed to open.")
+        else:
+            fourcc = int(self.camera.get(cv2.CAP_PROP_FOURCC))
+            fourcc_str = "".join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4))
+            if fourcc_str != "MJPG":
+                print(f"camera ignored mjpg request, capturing as {fourcc_str!r}")
+
+        # capture runs on its own thread so the blocking read overlaps with inference
+        # only the newest frame is kept, stale frames are simply overwritten
+        self.latest = None
+        self.frame_seq = 0  # bumped for every captured frame so consumers can spot new ones
+        self.lock = threading.Lock()
+        self.new_frame = threading.Condition(self.lock)
+        self.frame_ready = threading.Event()
+        self.stopped = False
 
-        self._setup_models()
+        # stream clients register an asyncio queue, the processing thread pushes each new jpeg
+        # into every queue. weak keys so a client that vanishes without unsubscribing is freed
+        self.subscribers = weakref.WeakKeyDictionary()  # queue -> event loop it belongs to
+        self.has_subscribers = threading.Event()
+        self._last_jpeg = b''
+        self._published_seq = 0  # last encode handed to the streams, so a late one can't go out of order
+        # (status, score, frame_id) of the last processed frame, swapped in as one tuple
+        self._last_stats = ("FOCUSED", 100, 0)
+        self.grab_thread = threading.Thread(target=self._grab_loop, daemon=True)
+        self.grab_thread.start()
+
+        self.pose_landmarker, self.detector = _get_models()
+        # pose and object models are independent and mediapipe drops the gil while inferring,
+        # so we run them side by side instead of back to back
+        self.pool = ThreadPoolExecutor(max_workers=2)
+
+        # jpeg encoder for the stream, falls back to cv2.imencode when turbojpeg is unavailable
+        # 70 looks the same as 85 in the dashboard but encodes faster and is ~25% smaller
+        self.STREAM_JPEG_QUALITY = 70
+        # the dashboard shows the feed well under 1080p, so the stream is scaled down before encoding
+        # a 720p jpeg is less than half the bytes of a 1080p one, snapshots still use the full frame
+        # frames are fit inside this box keeping their aspect ratio, the buffer is sized on the first frame
+        self.STREAM_SIZE = (1280, 720)
+        self._stream_buf = None
+        self.jpeg = None
+        if TurboJPEG is not None:
+            try:
+                self.jpeg = TurboJPEG()
+            except (OSError, RuntimeError):
+                print("libturbojpeg not found, using opencv jpeg encoder.")
+
+        # shame snapshots are encoded and written on a worker so the video loop never waits on disk
+        # bounded so a stalled disk can't pile up full-size frames in memory, the oldest pending one is dropped
+        self.snapshot_q = queue.Queue(maxsize=32)
+        # created here too so the camera doesn't depend on main.py having made it first
+        self.shame_dir = os.path.join(os.path.dirname(__file__), 'static', 'shame')
+        os.makedirs(self.shame_dir, exist_ok=True)
+        self.snapshot_thread = threading.Thread(target=self._snapshot_loop, daemon=True)
+        self.snapshot_thread.start()
 
         self.status = "FOCUSED"
         self.focus_score = 100
         self.distracted_frames = 0
         self.DISTRACTION_THRESHOLD = 15
-        self.start_time_ms = int(time.time() * 1000)  # start time in milliseconds
+        # models resize internally to ~256-320px, so feeding them 1080p is wasted bandwidth
+        # we run inference on this smaller copy and keep the full frame for drawing/jpeg
+        self.INFERENCE_SIZE = (640, 360)
+
+        # per-frame working buffers, allocated once instead of ~6mb of fresh arrays every frame
+        # two flip buffers so one can still be encoding while the next frame renders into the other
+        # sized on the first frame since the camera may not honor 1080p
+        self._flip_bufs = [None, None]
+        self._flip_idx = 0
+        self._small_buf = np.empty((self.INFERENCE_SIZE[1], self.INFERENCE_SIZE[0], 3), dtype=np.uint8)
+        self._rgb_buf = np.empty_like(self._small_buf)
+
+        self._prerender_hud()
+
+        # inference scheduling state (cadence + motion gate)
+        self.pose_needed = True  # whether the last frame fell through to the posture check
+        self.frame_idx = 0
+        self._last_det = None
+        self._last_pose = None
+        self.MOTION_THRESHOLD = 3.0  # mean abs gray difference on a 160x90 thumbnail
+        self.MAX_REUSED_FRAMES = 30
+        self._ref_gray = None
+        self._reused_frames = 0
         
         # calibration state
         # default fallback is 0.22, which is forgiving but effective
@@ -39,8 +231,17 @@ class VideoCamera:
         self.calibration_frames = 0  # track frames to show visual feedback
         
         # session history tracking
-        self.history = []
-        self.sessions = []
+        # capped so a long running process doesn't grow (and re-serialize) its history forever
+        # this is also what /api/history returns, anything older is only reachable through its session
+        # shame screenshots are deleted once no event in history or a session still points at them
+        self.MAX_HISTORY = 100
+        self.MAX_SESSIONS = 200
+        self.history = deque(maxlen=self.MAX_HISTORY)
+        self.sessions = deque(maxlen=self.MAX_SESSIONS)
+        # bumped whenever history or sessions change, lets the api reuse serialized responses
+        self.history_version = 0
+        # events filed per session so /api/history/{id} never scans the global history
+        self.session_events = {}  # session id -> events recorded during that session
         self.is_currently_distracted = False
         self.distraction_start_time = None
         self.distraction_reason = ""
@@ -48,70 +249,235 @@ class VideoCamera:
         
         # current session tracking
         self.current_session_start = None
-        self.current_session_history_index = None
+        self.current_session_id = None
+        self.current_session_events = []  # events logged since the session started
         self.current_session_scores = []  # track focus scores over time for sparkline
         self.last_score_record_time = None
         self.current_session_scores = []  # track focus scores over time for sparkline
         self.last_score_record_time = None
 
+        # processing runs on its own thread and paces itself to the camera
+        self.process_thread = threading.Thread(target=self._process_loop, daemon=True)
+        self.process_thread.start()
+
     def calibrate(self):
         # trigger flag to capture posture on next frame
         self.is_calibrating = True
 
-    def _setup_models(self):
-        # auto-download mediapipe models to local /models folder
-        model_dir = os.path.join(os.path.dirname(__file__), 'models')
-        os.makedirs(model_dir, exist_ok=True)
-
-        def download(url, filename):
-            path = os.path.join(model_dir, filename)
-            if not os.path.exists(path):
-                print(f"downloading {filename}...")
-                urllib.request.urlretrieve(url, path)
-            return path
-
-        # pose model for head tilt/slouch
-        # using the 'full' model for better accuracy on shoulder tracking
-        pose_path = download(
-            "https://storage.googleapis.com/mediapipe-models/pose_landmarker/pose_landmarker_full/float16/1/pose_landmarker_full.task",
-            "pose_landmarker_full.task"
-        )
-        self.pose_landmarker = vision.PoseLandmarker.create_from_options(
-            vision.PoseLandmarkerOptions(
-                base_options=python.BaseOptions(model_asset_path=pose_path),
-                running_mode=vision.RunningMode.VIDEO
-            )
-        )
+    def _prerender_hud(self):
+        # the hud only ever shows a handful of fixed strings, so rasterize each glyph mask once
+        # and stamp it onto the frame instead of running putText on the full frame every time
+        labels = {
+            "VISION ACTIVE": (1.0, (0, 255, 0), 2),
+            "STUDY MODE": (1.0, (255, 0, 0), 2),
+            "WARNING: PHONE": (1.2, (0, 0, 255), 3),
+            "WARNING: POSTURE": (1.2, (0, 0, 255), 3),
+            "WORK DETECTED": (0.6, (255, 0, 0), 2),
+            "CALIBRATED": (0.8, (0, 255, 0), 2),
+            "EYES UP": (0.5, (0, 0, 255), 1),
+        }
+        self._hud = {}
+        for text, (scale, color, thickness) in labels.items():
+            (text_w, text_h), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+            # pad by the stroke thickness since glyphs bleed past the nominal text box
+            pad = thickness
+            mask = np.zeros((text_h + baseline + 2 * pad, text_w + 2 * pad), dtype=np.uint8)
+            cv2.putText(mask, text, (pad, text_h + pad), cv2.FONT_HERSHEY_SIMPLEX, scale, 255, thickness)
+            self._hud[text] = (mask > 0, np.array(color, dtype=np.uint8), (pad, text_h + pad))
 
-        # object model for phones and study material
-        det_path = download(
-            "https://storage.googleapis.com/mediapipe-models/object_detector/efficientdet_lite2/float32/1/efficientdet_lite2.tflite",
-            "efficientdet_lite2.tflite"
-        )
-        self.detector = vision.ObjectDetector.create_from_options(
-            vision.ObjectDetectorOptions(
-                base_options=python.BaseOptions(model_asset_path=det_path),
-                score_threshold=0.5, # hopefully more confident
-                category_allowlist=["cell phone", "mobile phone", "book", "laptop", "tablet"]
-            )
-        )
+    def _draw_hud(self, frame, text, org):
+        # same placement as cv2.putText: org is the bottom-left corner of the text
+        mask, color, (off_x, off_y) = self._hud[text]
+        x, y = org[0] - off_x, org[1] - off_y
+
+        # clip the tile so labels near the edge are cut off rather than wrapping
+        frame_h, frame_w = frame.shape[:2]
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + mask.shape[1], frame_w), min(y + mask.shape[0], frame_h)
+        if x0 >= x1 or y0 >= y1:
+            return
+        roi = frame[y0:y1, x0:x1]
+        roi[mask[y0 - y:y1 - y, x0 - x:x1 - x]] = color
+
+    def _grab_loop(self):
+        while not self.stopped:
+            if not self.camera.grab():
+                # camera dropped out, report the error to the streams instead of a frozen frame
+                with self.lock:
+                    self.latest = None
+                self.frame_ready.clear()
+                time.sleep(0.1)
+                continue
+
+            success, frame = self.camera.retrieve()
+            if success:
+                with self.new_frame:
+                    self.latest = frame
+                    self.frame_seq += 1
+                    self.new_frame.notify_all()
+                self.frame_ready.set()
+
+    def _process_loop(self):
+        # process each captured frame once and push the jpeg to every subscribed stream
+        # this thread is the only one rendering, so the working buffers need no lock
+        last_seq = -1
+        pending = None  # jpeg encode of the previous frame, running on the pool
+        encode_seq = 0
+        while not self.stopped:
+            if not self.has_subscribers.wait(timeout=0.5):
+                # everyone left, let the last encode finish before its buffer is reused
+                if pending is not None:
+                    wait([pending])
+                    pending = None
+                continue
+
+            # block until the grab thread has something we haven't processed yet
+            with self.new_frame:
+                self.new_frame.wait_for(lambda: self.frame_seq != last_seq or self.stopped, timeout=1.0)
+                last_seq = self.frame_seq
+            if self.stopped:
+                break
+
+            # this is the only processing thread, one bad frame must not take the feed down
+            # for every client, so log it and skip that frame
+            failed = False
+            try:
+                frame = self._render_frame()
+            except Exception as e:
+                print(f"failed to process frame: {e!r}")
+                frame, failed = None, True
+
+            # the previous frame has been encoding on the pool while we ran inference on this one
+            # it publishes itself when done, we only wait so its flip buffer is free for the next render
+            if pending is not None:
+                wait([pending])
+                pending = None
+
+            if failed:
+                continue
+            if frame is None:
+                # camera error, an empty frame tells the streams to close
+                # claim a sequence number so a late callback from the last encode can't follow it
+                encode_seq += 1
+                with self.lock:
+                    self._published_seq = encode_seq
+                self._publish(b'')
+                continue
+            encode_seq += 1
+            pending = self.pool.submit(self._encode_stream, frame)
+            pending.add_done_callback(functools.partial(self._publish_encoded, encode_seq))
+
+    def _publish_encoded(self, seq, pending):
+        # runs on the pool thread as soon as an encode finishes, a failed one only costs that frame
+        try:
+            frame_bytes = pending.result()
+        except Exception as e:
+            print(f"failed to encode frame: {e!r}")
+            return
+        with self.lock:
+            if seq <= self._published_seq:
+                return
+            self._published_seq = seq
+        self._publish(frame_bytes)
+
+    def _publish(self, frame_bytes):
+        if frame_bytes:
+            self._last_jpeg = frame_bytes
+        with self.lock:
+            subscribers = list(self.subscribers.items())
+            # a queue that was garbage collected leaves without unsubscribe(), so catch it here
+            if not subscribers:
+                self.has_subscribers.clear()
+        for q, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(_put_latest, q, frame_bytes)
+            except RuntimeError:
+                # the client's event loop is already closed
+                self.unsubscribe(q)
+
+    def subscribe(self, q, loop):
+        # called by the streaming route, frames are only processed while someone is watching
+        with self.lock:
+            self.subscribers[q] = loop
+            self.has_subscribers.set()
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.pop(q, None)
+            if not self.subscribers:
+                self.has_subscribers.clear()
 
     def get_frame(self):
-        success, frame = self.camera.read()
-        if not success: return b'', "ERROR", 0
+        # latest jpeg pushed to the streams with its status/score
+        # frames are rendered on the processing thread, and only while someone is subscribed
+        status, score, _ = self._last_stats
+        return self._last_jpeg, status, score
+
+    def get_stats(self):
+        # status/score from the last processed frame without capturing or encoding anything
+        return self._last_stats
+
+    def _render_frame(self):
+        # wait briefly for the first frame after startup
+        self.frame_ready.wait(timeout=1.0)
+        with self.lock:
+            frame = self.latest
+        if frame is None: return None
 
-        frame = cv2.flip(frame, 1)
+        # flip into the buffer that isn't being encoded, reallocated only if the resolution changes
+        self._flip_idx ^= 1
+        flip_buf = self._flip_bufs[self._flip_idx]
+        if flip_buf is None or flip_buf.shape != frame.shape:
+            flip_buf = self._flip_bufs[self._flip_idx] = np.empty_like(frame)
+        frame = cv2.flip(frame, 1, dst=flip_buf)
         h, w = frame.shape[:2]
-        
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_frame)
+
+        # downscale before the color conversion so cvtColor only touches 1/9 of the pixels
+        # detection boxes get mapped back to the full frame with these factors
+        scale_x = w / self.INFERENCE_SIZE[0]
+        scale_y = h / self.INFERENCE_SIZE[1]
+        rgb_small = cv2.cvtColor(
+            cv2.resize(frame, self.INFERENCE_SIZE, dst=self._small_buf, interpolation=cv2.INTER_AREA),
+            cv2.COLOR_BGR2RGB,
+            dst=self._rgb_buf
+        )
+        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_small)
 
         # run ai inference
-        # video mode requires timestamp - use actual time relative to start
-        current_time_ms = int(time.time() * 1000) - self.start_time_ms
-        pose_result = self.pose_landmarker.detect_for_video(mp_image, current_time_ms)
-        
-        det_result = self.detector.detect(mp_image)
+        # motion gate: if the scene barely changed since the last inference, reuse those results
+        # we compare against the frame the models last saw (not the previous frame) so a slow
+        # slouch still adds up, and force a refresh every MAX_REUSED_FRAMES frames regardless
+        gray_small = cv2.cvtColor(
+            cv2.resize(self._small_buf, (160, 90), interpolation=cv2.INTER_AREA),
+            cv2.COLOR_BGR2GRAY
+        )
+        is_static = (
+            self._ref_gray is not None
+            and self._reused_frames < self.MAX_REUSED_FRAMES
+            and cv2.absdiff(gray_small, self._ref_gray).mean() < self.MOTION_THRESHOLD
+        )
+
+        # the models take turns: detector on even frames, pose on odd frames
+        # the 15 frame hysteresis smooths over the one frame old results we reuse in between
+        self.frame_idx += 1
+        det_due = self._last_det is None or (not is_static and self.frame_idx % 2 == 0)
+        pose_due = self._last_pose is None or (not is_static and self.frame_idx % 2 == 1)
+        # pose is skipped while a phone or book is in view, so a pending pose doesn't count as a refresh
+        ran = det_due or (pose_due and self.pose_needed)
+        if ran:
+            self._reused_frames = 0
+            self._ref_gray = gray_small
+        else:
+            self._reused_frames += 1
+
+        # pose only matters when no phone or study material is in view, so the detector goes first
+        # if the last frame needed pose we start it alongside the detector instead of waiting
+        pose_future = None
+        if pose_due and self.pose_needed:
+            pose_future = self.pool.submit(self.pose_landmarker.detect, mp_image)
+        if det_due:
+            self._last_det = self.detector.detect(mp_image)
+        det_result = self._last_det
 
         # state flags
         has_phone = False
@@ -123,23 +489,45 @@ class VideoCamera:
         # books/laptops/tablets are whitelisted (allow looking down to study)
         if det_result.detections:
             for detection in det_result.detections:
-                category = detection.categories[0].category_name
-                score = detection.categories[0].score
+                top = detection.categories[0]
+                category = top.category_name
+                score = top.score
                 bbox = detection.bounding_box
+                # boxes are in inference pixels, scale them up to the full frame
+                box_x = int(bbox.origin_x * scale_x)
+                box_y = int(bbox.origin_y * scale_y)
+                box_w = int(bbox.width * scale_x)
+                box_h = int(bbox.height * scale_y)
                 
                 # blacklist: phones (always trigger distraction)
-                if category in ["cell phone", "mobile phone"]:
+                if category in PHONE_CATEGORIES:
                     has_phone = True
                     # draw red box immediately on phone
-                    cv2.rectangle(frame, (bbox.origin_x, bbox.origin_y), 
-                                 (bbox.origin_x + bbox.width, bbox.origin_y + bbox.height), (0, 0, 255), 4)
-                    cv2.putText(frame, f"PHONE ({score:.2f})", (bbox.origin_x, bbox.origin_y - 10),
+                    cv2.rectangle(frame, (box_x, box_y), 
+                                 (box_x + box_w, box_y + box_h), (0, 0, 255), 4)
+                    cv2.putText(frame, f"PHONE ({score:.2f})", (box_x, box_y - 10),
                                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
                                
                 # whitelist: books, laptops, tablets
-                elif category in ["book", "laptop", "tablet"]:
+                elif category in STUDY_CATEGORIES:
                     has_study_material = True
-                    study_box = bbox
+                    study_box = (box_x, box_y, box_w, box_h)
+
+                # nothing left to learn once both flags are set
+                if has_phone and has_study_material:
+                    break
+
+        self.pose_needed = not has_phone and not has_study_material
+        fresh_pose = pose_future.result() if pose_future else None
+        if fresh_pose is None and pose_due and self.pose_needed:
+            fresh_pose = self.pose_landmarker.detect(mp_image)
+        if fresh_pose is not None:
+            self._last_pose = fresh_pose
+        elif not self.pose_needed:
+            # a pose from before the phone or book showed up can be minutes old,
+            # forget it so pose_due forces a fresh one once the object leaves
+            self._last_pose = None
+        pose_result = self._last_pose if self.pose_needed else None
 
         # logic decision tree
         is_distracted = False
@@ -160,30 +548,31 @@ class VideoCamera:
             
             # draw blue box to indicate safe zone
             if study_box:
-                cv2.rectangle(frame, (study_box.origin_x, study_box.origin_y), 
-                             (study_box.origin_x + study_box.width, study_box.origin_y + study_box.height), (255, 0, 0), 2)
-                cv2.putText(frame, "WORK DETECTED", (study_box.origin_x, study_box.origin_y - 10),
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2)
+                box_x, box_y, box_w, box_h = study_box
+                cv2.rectangle(frame, (box_x, box_y), 
+                             (box_x + box_w, box_y + box_h), (255, 0, 0), 2)
+                self._draw_hud(frame, "WORK DETECTED", (box_x, box_y - 10))
 
         # priority #3: posture detection (fallback)
         # only check this if no phone was found and no work materials are visible
-        elif pose_result.pose_landmarks:
+        elif pose_result and pose_result.pose_landmarks:
             landmarks = pose_result.pose_landmarks[0]
             
             # extract normalized coordinates (0.0 is top, 1.0 is bottom)
-            nose = landmarks[0]
-            left_shoulder = landmarks[11]
-            right_shoulder = landmarks[12]
+            # read each landmark once, the accessors are slow compared to plain array indexing
+            # order: nose, left shoulder, right shoulder
+            ys = np.array([landmarks[0].y, landmarks[11].y, landmarks[12].y], dtype=np.float32)
+            nose_y = ys[0]
             
             # calculate the average height of the user's shoulders
-            shoulder_y = (left_shoulder.y + right_shoulder.y) / 2
+            shoulder_y = 0.5 * (ys[1] + ys[2])
 
             # calibration check
             # if user requested calibration, capture current posture as the new 100%
             # we add a 0.05 buffer so they can move slightly without triggering
             if self.is_calibrating:
-                current_dist = shoulder_y - nose.y
-                self.baseline_dist = current_dist - 0.05
+                current_dist = shoulder_y - nose_y
+                self.baseline_dist = float(current_dist - 0.05)
                 self.is_calibrating = False
                 self.calibration_frames = 30  # show green line for ~1 second at 30fps
                 print(f"calibrated: new threshold offset is {self.baseline_dist}")
@@ -199,8 +588,7 @@ class VideoCamera:
                 thickness = int(2 + pulse_intensity * 2)
                 
                 cv2.line(frame, (0, line_y_px), (w, line_y_px), (0, 255, 0), thickness)
-                cv2.putText(frame, "CALIBRATED", (w // 2 - 80, line_y_px - 15), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+                self._draw_hud(frame, "CALIBRATED", (w // 2 - 80, line_y_px - 15))
                 
                 self.calibration_frames -= 1
             
@@ -209,7 +597,7 @@ class VideoCamera:
             # to create a limit line near the chin.
             threshold_val = shoulder_y - self.baseline_dist
 
-            if nose.y > threshold_val:
+            if nose_y > threshold_val:
                 is_distracted = True
                 reason = "POSTURE"
                 
@@ -221,8 +609,7 @@ class VideoCamera:
                 text_y = line_y_px - 10
                 if text_y < 20: text_y = line_y_px + 20 
                 
-                cv2.putText(frame, "EYES UP", (10, text_y), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+                self._draw_hud(frame, "EYES UP", (10, text_y))
             else:
                  # visual debugging: draw the safe line (green)
                  # this helps users calibrate manually if needed
@@ -236,6 +623,12 @@ class VideoCamera:
             # reset the counter to zero immediately when distraction is gone
             self.distracted_frames = 0
 
+        # stop_session runs on the event loop thread and can clear these while we render,
+        # so read them once and use the locals for the rest of the frame
+        session_start = self.current_session_start
+        session_events = self.current_session_events
+        session_scores = self.current_session_scores
+
         # state transition detection for history
         if not self.is_currently_distracted and self.distracted_frames > self.DISTRACTION_THRESHOLD:
             # distraction starts
@@ -245,9 +638,11 @@ class VideoCamera:
             
             # capture screenshot
             snapshot_filename = f"shame/{uuid.uuid4()}.jpg"
-            snapshot_path = os.path.join(os.path.dirname(__file__), 'static', snapshot_filename)
-            cv2.imwrite(snapshot_path, frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            snapshot_path = os.path.join(self.shame_dir, os.path.basename(snapshot_filename))
+            # set before queueing so the writer's prune already sees the file as referenced
             self.distraction_snapshot_filename = snapshot_filename
+            # copy since the frame buffer is reused on the next frame
+            self._queue_snapshot((snapshot_path, frame.copy()))
             print(f"distraction started: {reason}, snapshot: {snapshot_filename}")
 
         elif self.is_currently_distracted and self.distracted_frames <= self.DISTRACTION_THRESHOLD:
@@ -255,13 +650,17 @@ class VideoCamera:
             self.is_currently_distracted = False
             if self.distraction_start_time:
                 duration = time.time() - self.distraction_start_time
-                self.history.append({
+                event = {
                     "id": str(uuid.uuid4()),
                     "timestamp": int(self.distraction_start_time),
                     "reason": self.distraction_reason,
                     "duration": duration,
                     "snapshot_url": self.distraction_snapshot_filename
-                })
+                }
+                self.history.append(event)
+                if session_start is not None:
+                    session_events.append(event)
+                self.history_version += 1
                 print(f"distraction ended: {self.distraction_reason}, duration: {duration:.2f}s")
             self.distraction_start_time = None
             self.distraction_reason = ""
@@ -271,40 +670,117 @@ class VideoCamera:
         if self.distracted_frames > self.DISTRACTION_THRESHOLD:
             self.status = "DISTRACTED" 
             self.focus_score = max(0, self.focus_score - 0.5)
-            cv2.putText(frame, f"WARNING: {reason}", (30, 80), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 255), 3)
+            self._draw_hud(frame, f"WARNING: {reason}", (30, 80))
         else:
             self.status = "FOCUSED"
             self.focus_score = min(100, self.focus_score + 0.1)
         
         # record score for sparkline (every 2 seconds during active session)
-        if self.current_session_start is not None:
+        if session_start is not None:
             current_time = time.time()
             if self.last_score_record_time is None or (current_time - self.last_score_record_time) >= 2.0:
-                self.current_session_scores.append({
-                    "time": current_time - self.current_session_start,
+                session_scores.append({
+                    "time": current_time - session_start,
                     "score": int(self.focus_score)
                 })
                 self.last_score_record_time = current_time
             
             # update hud based on context
             status_text = "STUDY MODE" if has_study_material else "VISION ACTIVE"
-            color = (255, 0, 0) if has_study_material else (0, 255, 0)
-            
-            cv2.putText(frame, status_text, (30, 80), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2)
+            self._draw_hud(frame, status_text, (30, 80))
+
+        self._last_stats = (self.status, int(self.focus_score), self._last_stats[2] + 1)
+        return frame
+
+    def _queue_snapshot(self, item):
+        # never block the video loop, make room by dropping the oldest snapshot instead
+        # only called from the processing thread, the same one that owns distraction_snapshot_filename
+        while True:
+            try:
+                self.snapshot_q.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    dropped_path, _ = self.snapshot_q.get_nowait()
+                except queue.Empty:
+                    continue
+                # that file will never be written, don't let the open distraction point at it
+                # events that were already recorded are handled by the dashboard hiding broken images
+                current = self.distraction_snapshot_filename
+                if current and os.path.basename(current) == os.path.basename(dropped_path):
+                    self.distraction_snapshot_filename = None
+
+    def _snapshot_loop(self):
+        while True:
+            item = self.snapshot_q.get()
+            if item is None:
+                break
+            path, frame = item
+            # write beside the target and rename, so /static/shame never serves a half-written jpeg
+            tmp_path = path + '.tmp'
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(self._encode_jpeg(frame, 85))
+                os.replace(tmp_path, path)
+                self._prune_snapshots(os.path.dirname(path))
+            except OSError as e:
+                # a failed write only loses this screenshot, the writer keeps going
+                print(f"failed to save snapshot {path}: {e}")
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
 
-        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-        return buffer.tobytes(), self.status, int(self.focus_score)
+    def _referenced_snapshots(self):
+        # every screenshot an api response can still point at
+        # runs on the writer thread, list() copies each container in one step so the
+        # processing thread appending at the same time can't break the iteration
+        # the in-progress filename is read first: the processing thread appends the finished
+        # event to history before clearing it, so one of the two reads always sees the file
+        current = self.distraction_snapshot_filename
+        events = list(self.history) + list(self.current_session_events)
+        for session in list(self.session_events.values()):
+            events += list(session)
+        referenced = {os.path.basename(e["snapshot_url"]) for e in events if e["snapshot_url"]}
+        if current:
+            referenced.add(os.path.basename(current))
+        return referenced
+
+    def _prune_snapshots(self, shame_dir):
+        # delete screenshots that no event references any more
+        referenced = self._referenced_snapshots()
+        for name in os.listdir(shame_dir):
+            if name.endswith('.jpg') and name not in referenced:
+                try:
+                    os.remove(os.path.join(shame_dir, name))
+                except OSError:
+                    pass
+
+    def _encode_stream(self, frame):
+        # only one stream encode is in flight at a time, so the resize buffer can be shared
+        h, w = frame.shape[:2]
+        scale = min(self.STREAM_SIZE[0] / w, self.STREAM_SIZE[1] / h)
+        if scale < 1:
+            size = (round(w * scale), round(h * scale))
+            if self._stream_buf is None or self._stream_buf.shape[:2] != (size[1], size[0]):
+                self._stream_buf = np.empty((size[1], size[0], 3), dtype=np.uint8)
+            frame = cv2.resize(frame, size, dst=self._stream_buf, interpolation=cv2.INTER_AREA)
+        return self._encode_jpeg(frame, self.STREAM_JPEG_QUALITY)
+
+    def _encode_jpeg(self, frame, quality):
+        if self.jpeg is not None:
+            return self.jpeg.encode(frame, quality=quality, pixel_format=TJPF_BGR)
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return buffer.tobytes()
 
     def start_session(self):
         # start a new session
-        self.current_session_start = time.time()
-        self.current_session_history_index = len(self.history)
-        self.current_session_scores = []
-        self.last_score_record_time = None
+        # fresh lists go in before the start time, the processing thread only appends once it sees a start
+        self.current_session_events = []
         self.current_session_scores = []
+        self.current_session_id = str(uuid.uuid4())
         self.last_score_record_time = None
+        self.current_session_start = time.time()
         
     def stop_session(self):
         # end current session and create summary
@@ -315,7 +791,7 @@ class VideoCamera:
         session_duration = session_end - self.current_session_start
         
         # get all events for this session
-        session_events = self.history[self.current_session_history_index:] if self.current_session_history_index is not None else self.history
+        session_events = self.current_session_events
         
         # calculate stats
         distraction_count = len(session_events)
@@ -323,7 +799,7 @@ class VideoCamera:
         avg_focus_score = 100  # placeholder - we don't track average score yet
         
         session_summary = {
-            "id": str(uuid.uuid4()),
+            "id": self.current_session_id,
             "start_time": int(self.current_session_start),
             "end_time": int(session_end),
             "duration": session_duration,
@@ -333,21 +809,47 @@ class VideoCamera:
             "score_history": self.current_session_scores  # for sparkline visualization
         }
         
+        # the deque drops its oldest session when full, forget that one's events too
+        if len(self.sessions) == self.sessions.maxlen:
+            self.session_events.pop(self.sessions[0]["id"], None)
         self.sessions.append(session_summary)
+        self.session_events[session_summary["id"]] = session_events
+        self.history_version += 1
+
         self.current_session_start = None
-        self.current_session_history_index = None
+        self.current_session_id = None
+        self.current_session_events = []
         self.current_session_scores = []
         self.last_score_record_time = None
         
         return session_summary
     
-    def get_history(self):
-        # return history list (most recent first)
-        return list(reversed(self.history))
+    def get_history(self, limit=None):
+        # return history list (most recent first), limit=None returns everything we still have
+        return list(itertools.islice(reversed(self.history), limit))
     
     def get_sessions(self):
         # return session summaries (most recent first)
         return list(reversed(self.sessions))
 
+    def get_session_events(self, session_id):
+        # return the events recorded during one session (most recent first), None if unknown
+        events = self.session_events.get(session_id)
+        if events is None:
+            return None
+        return list(reversed(events))
+
     def release(self):
+        self.stopped = True
+        with self.new_frame:
+            self.new_frame.notify_all()
+        self.grab_thread.join(timeout=1.0)
+        self.process_thread.join(timeout=1.0)
+        # wait for room instead of dropping a real snapshot to fit the sentinel
+        try:
+            self.snapshot_q.put(None, timeout=1.0)
+        except queue.Full:
+            print("snapshot writer is stuck, skipping its shutdown")
+        self.snapshot_thread.join(timeout=1.0)
+        self.pool.shutdown()
         self.camera.release()
@@ -1,24 +1,67 @@
-from fastapi import FastAPI, Request, Depends, HTTPException
-from fastapi.responses import StreamingResponse, HTMLResponse, RedirectResponse, JSONResponse
+from fastapi import FastAPI, Request, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, HTMLResponse, RedirectResponse, JSONResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
 from camera import VideoCamera
-import time
-import os
-
-app = FastAPI(title="Peer - Visual Accountability")
-templates = Jinja2Templates(directory="templates")
+from pathlib import Path
+import asyncio
+import logging
+import orjson
+import uuid
+
+# uvicorn's default websocket backend raises its own error when sending to a closed socket
+try:
+    from websockets.exceptions import ConnectionClosed
+except ImportError:
+    ConnectionClosed = None
+
+# orjson serializes the history/session lists several times faster than the stdlib encoder
+app = FastAPI(title="Peer - Visual Accountability", default_response_class=ORJSONResponse)
+templates = Jinja2Templates(directory=str(Path(__file__).parent / "templates"))
+
+# compile the dashboard once: bytecode is cached on disk across restarts/workers and
+# the template isn't stat'ed for changes on every render
+# jinja's default cache dir is per user, created 0700 and ownership-checked, so another
+# local user can't plant bytecode for us to load
+templates.env.bytecode_cache = FileSystemBytecodeCache()
+templates.env.auto_reload = False
+_INDEX_TEMPLATE = templates.get_template("index.html")
 
 # ensure static/shame directory exists
-static_dir = os.path.join(os.path.dirname(__file__), 'static')
-shame_dir = os.path.join(static_dir, 'shame')
-os.makedirs(shame_dir, exist_ok=True)
+_STATIC = Path(__file__).parent / "static"
+_SHAME = _STATIC / "shame"
+_SHAME.mkdir(parents=True, exist_ok=True)
+
+class CachedStatic(StaticFiles):
+    # shame screenshots are written once under a fresh uuid name and only renamed into place
+    # once complete, so they never change and the browser can keep them instead of
+    # re-fetching on every history render
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
 
 # mount static files so shame screenshots can be served
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# only the screenshots are immutable, the shame mount goes first so it wins over /static
+app.mount("/static/shame", CachedStatic(directory=str(_SHAME)), name="shame")
+app.mount("/static", StaticFiles(directory=str(_STATIC)), name="static")
 
 camera = VideoCamera()
 
+class QuietPollingFilter(logging.Filter):
+    # the dashboard polls /stats twice a second and reopens /video_feed, keep those out of the access log
+    QUIET_PATHS = {"/video_feed", "/stats"}
+
+    def filter(self, record):
+        # uvicorn access records are (client, method, path, http_version, status)
+        args = record.args
+        if isinstance(args, tuple) and len(args) >= 3:
+            return str(args[2]).split("?", 1)[0] not in self.QUIET_PATHS
+        return True
+
+logging.getLogger("uvicorn.access").addFilter(QuietPollingFilter())
+
 # mock user for demo
 MOCK_USER = {
     "user_id": "gaucho_001",
@@ -26,10 +69,17 @@ MOCK_USER = {
     "email": "nathan_ngo@ucsb.edu",
 }
 
+_MISSING = object()
+
 async def get_current_user(request: Request):
-    if request.cookies.get("access_token") == "mock_valid_token":
-        return MOCK_USER
-    return None
+    # memoized on the request so repeated auth checks skip the cookie parse
+    user = getattr(request.state, "_user_cache", _MISSING)
+    if user is not _MISSING:
+        return user
+
+    user = MOCK_USER if request.cookies.get("access_token") == "mock_valid_token" else None
+    request.state._user_cache = user
+    return user
 
 async def require_auth(request: Request):
     user = await get_current_user(request)
@@ -57,23 +107,91 @@ async def me(request: Request):
     user = await get_current_user(request)
     return {"authenticated": True, "user": user} if user else {"authenticated": False}
 
-def generate_frames():
+async def camera_frames():
+    # the camera pushes each new jpeg into our queue, so this paces itself to the camera
+    # and never resends a frame. inference only runs while at least one stream is subscribed
+    queue = asyncio.Queue(maxsize=1)
+    camera.subscribe(queue, asyncio.get_running_loop())
+    try:
+        while True:
+            frame_bytes = await queue.get()
+            if not frame_bytes: break
+            yield frame_bytes
+    finally:
+        camera.unsubscribe(queue)
+
+# multipart framing for the mjpeg stream, joined with each frame in a single allocation
+# Content-Length lets clients read each part in one go instead of scanning for the boundary
+_PART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n'
+_PART_END = b'\r\n'
+
+async def generate_frames():
     # stream video frames
-    while True:
-        frame_bytes, _, _ = camera.get_frame()
-        if frame_bytes:
-            yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-        else: break
-        time.sleep(0.033)
+    async for frame_bytes in camera_frames():
+        yield b''.join((_PART_HEADER % len(frame_bytes), frame_bytes, _PART_END))
 
 @app.get("/video_feed")
 async def feed():
-    return StreamingResponse(generate_frames(), media_type="multipart/x-mixed-replace; boundary=frame")
+    # tell reverse proxies (nginx, caddy) not to buffer the stream, each part should go out as soon as it's written
+    return StreamingResponse(
+        generate_frames(),
+        media_type="multipart/x-mixed-replace; boundary=frame",
+        headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"},
+    )
+
+_WS_CLOSED = (WebSocketDisconnect, OSError) + ((ConnectionClosed,) if ConnectionClosed else ())
+
+@app.websocket("/ws/video")
+async def video_ws(websocket: WebSocket):
+    # one binary message per jpeg, the browser can drop late frames instead of stalling
+    # on a multipart stream. /video_feed stays as the fallback
+    await websocket.accept()
+    frames = camera_frames()
+    try:
+        async for frame_bytes in frames:
+            await websocket.send_bytes(frame_bytes)
+        await websocket.close()
+    except _WS_CLOSED:
+        # the browser went away mid-send. depending on uvicorn's websocket backend that
+        # surfaces as WebSocketDisconnect, OSError or the backend's own ConnectionClosed
+        pass
+    finally:
+        await frames.aclose()
+
+def conditional_json(request: Request, etag: str, content):
+    # pollers revalidate with If-None-Match, unchanged data costs a bare 304
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(content, headers=headers)
+
+# serialized bodies for the history/session endpoints, name -> (camera.history_version, bytes)
+# the camera bumps history_version whenever an event or session is recorded
+_json_cache = {}
+# history_version restarts at 0 with every process, so the etag also carries a per-process id
+# otherwise a browser revalidating after a restart could get a 304 for the previous run's data
+_BOOT_ID = uuid.uuid4().hex
+
+def cached_json(request: Request, name: str, build):
+    version = camera.history_version
+    etag = f'"{name}-{_BOOT_ID}-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    hit = _json_cache.get(name)
+    if hit is None or hit[0] != version:
+        hit = (version, orjson.dumps(build()))
+        _json_cache[name] = hit
+    return Response(hit[1], media_type="application/json", headers=headers)
 
 @app.get("/stats")
-async def stats(user: dict = Depends(require_auth)):
-    _, status, score = camera.get_frame()
-    return {"focus_score": int(score), "status": status}
+async def stats(request: Request, user: dict = Depends(require_auth)):
+    # cached by the processing thread, polling never triggers a capture or jpeg encode
+    status, score, _ = camera.get_stats()
+    # etag on the values themselves, the frame id changes every frame and would never match
+    etag = f'"{status}-{score}"'
+    return conditional_json(request, etag, {"focus_score": int(score), "status": status})
 
 @app.post("/session/start")
 async def start(user: dict = Depends(require_auth)):
@@ -92,37 +210,28 @@ async def calibrate_camera(user: dict = Depends(require_auth)):
     return JSONResponse(content={"status": "calibrated", "message": "posture baseline updated"})
 
 @app.get("/api/history")
-async def history(user: dict = Depends(require_auth)):
+async def history(request: Request, user: dict = Depends(require_auth)):
     # return session history with shame screenshots
-    history_data = camera.get_history()
-    return {"history": history_data}
+    return cached_json(request, "history", lambda: {"history": camera.get_history()})
 
 @app.get("/api/history/{session_id}")
 async def session_history(session_id: str, user: dict = Depends(require_auth)):
     # return events for a specific session
-    sessions = camera.get_sessions()
-    session = next((s for s in sessions if s["id"] == session_id), None)
-    if not session:
-        return {"history": []}
-    
-    # filter events that occurred during this session
-    all_events = camera.get_history()
-    session_events = [
-        event for event in all_events 
-        if session["start_time"] <= event["timestamp"] <= session["end_time"]
-    ]
-    return {"history": session_events}
+    # events are filed under their session as they happen, so this is a dict lookup
+    session_events = camera.get_session_events(session_id)
+    return {"history": session_events or []}
 
 @app.get("/api/sessions")
-async def sessions(user: dict = Depends(require_auth)):
+async def sessions(request: Request, user: dict = Depends(require_auth)):
     # return session summaries
-    sessions_data = camera.get_sessions()
-    return {"sessions": sessions_data}
+    return cached_json(request, "sessions", lambda: {"sessions": camera.get_sessions()})
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return HTMLResponse(_INDEX_TEMPLATE.render(request=request))
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # single worker on purpose: the webcam can only be opened once and all state is in memory
+    # http/loop default to "auto", which already picks httptools + uvloop when installed
+    uvicorn.run(app, host="0.0.0.0", port=8000, workers=1)